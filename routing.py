@@ -1,150 +1,469 @@
-import json
 import argparse
-import ipaddress
+import ctypes
+from array import array
+import errno
+from functools import lru_cache
+import logging
+import os
+import signal
+import socket
+import struct
+import sys
 from scapy.all import *
 import threading
 import time
 
-# Define custom routing protocol (Layer 4 above IP) TRP (Table Routing Protocol)
-class TRP(Packet):
-    name = "TableRoutingProtocol"
-    fields_desc = [
-        IPField("network", "0.0.0.0"),     # Destination IP address
-        IntField("mask", 0),               # IP mask
-        IPField("next_hop", "0.0.0.0"),    # Next hop IP address
-        IntField("cost", 0),               # Distance metric
-        ShortField("protocol_id", 42)      # Protocol identifier for routing
-    ]
-
-    def show(self, *args, **kwargs):
-        "Pretty print the TableProtocol packet information."
-        print("TRP Packet Information:")
-        print("  - Network IP: {}/{}".format(self.network, self.mask))
-        print("  - Cost: {}".format(self.cost))
-        print("  - Next hop: {}".format(self.next_hop))
-        print("  - Protocol ID: {}".format(self.protocol_id))
-        print("\n")
-
-bind_layers(IP, TRP, proto=143)
-
-local_interfaces = {}
-routing_table = []
-
-def share_routes():
-    "Periodically send routing table updates to neighbors"
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+logger = logging.getLogger('routing')
+
+ETH_P_IP = 0x0800
+ETH_P_ALL = 0x0003
+
+# Custom routing protocol (Layer 4 above IP) TRP (Table Routing Protocol).
+# An advertisement is the protocol id followed by one fixed size record per route.
+TRP_PROTO = 143
+TRP_ID = 42
+TRP_MAX_COST = 255      # Costs are sent in a single byte
+TRP_OFFSET = 14 + 20    # Ethernet + IP header in our own advertisements
+SHARE_INTERVAL = 2      # Seconds between routing table advertisements
+FRAME_SIZE = 1514       # Ethernet MTU, not Scapy's 65535 default
+BATCH_SIZE = 32         # Frames moved per recvmmsg/sendmmsg call
+MSG_WAITFORONE = 0x10000
+BROADCAST_IP = 0xFFFFFFFF
+BROADCAST_MAC = b'\xff' * 6
+SO_ATTACH_FILTER = 26
+SKF_AD_PKTTYPE = 0xFFFFF000 + 4  # SKF_AD_OFF + 4, the packet type of a frame
+SKF_AD_IFINDEX = 0xFFFFF000 + 8  # SKF_AD_OFF + 8, the interface of a frame
+
+# IP protocol (offset 23) and destination (offset 30) of an Ethernet frame
+_IP_DISPATCH = struct.Struct("!23xB6xI")
+# TRP header (protocol id) and one record (network, mask, cost)
+_TRP_HEADER = struct.Struct("!H")
+_TRP_RECORD = struct.Struct("!IBB")
+TRP_HEADER_BYTES = _TRP_HEADER.pack(TRP_ID)
+# Netmask as int for every prefix length
+_NETMASKS = tuple((0xFFFFFFFF << (32 - mask)) & 0xFFFFFFFF for mask in range(33))
+# Whole records that fit in one advertisement frame
+MAX_ADVERT_PAYLOAD = (FRAME_SIZE - TRP_OFFSET - _TRP_HEADER.size) // _TRP_RECORD.size * _TRP_RECORD.size
+
+_libc = ctypes.CDLL(None, use_errno=True)
+
+class _IoVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p), ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(_IoVec)), ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p), ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _MsgHdr), ("msg_len", ctypes.c_uint)]
+
+class _SockAddrLL(ctypes.Structure):
+    _fields_ = [("sll_family", ctypes.c_ushort), ("sll_protocol", ctypes.c_ushort),
+                ("sll_ifindex", ctypes.c_int), ("sll_hatype", ctypes.c_ushort),
+                ("sll_pkttype", ctypes.c_ubyte), ("sll_halen", ctypes.c_ubyte),
+                ("sll_addr", ctypes.c_ubyte * 8)]
+
+_libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+_libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+
+def _check_errno(result):
+    if result < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return result
+
+def _retry_eintr(call, *args):
+    "Call a libc function, retrying when a signal interrupts it (ctypes calls get no PEP 475 retry)."
     while True:
-        for iface_name, iface_ip in local_interfaces.items():
-            for route in routing_table:
-                pkt = Ether(dst="ff:ff:ff:ff:ff:ff") / \
-                      IP(dst=iface_ip) / \
-                      TRP(network=route['network'], mask=int(route['mask']),
-                          next_hop=route['next_hop'], 
-                          cost=route['cost'])
+        result = call(*args)
+        if result >= 0 or ctypes.get_errno() != errno.EINTR:
+            return _check_errno(result)
+
+class RxBatch(object):
+    "Preallocated frame buffers filled by a single recvmmsg call."
+    def __init__(self, size=BATCH_SIZE):
+        self.size = size
+        self.frames = [bytearray(FRAME_SIZE) for _ in range(size)]
+        self.addrs = (_SockAddrLL * size)()
+        self.msgs = (_MMsgHdr * size)()
+        self._iovecs = (_IoVec * size)()
+        self._views = [(ctypes.c_char * FRAME_SIZE).from_buffer(f) for f in self.frames]
+        for i in range(size):
+            self._iovecs[i].iov_base = ctypes.addressof(self._views[i])
+            self._iovecs[i].iov_len = FRAME_SIZE
+            hdr = self.msgs[i].msg_hdr
+            hdr.msg_iov = ctypes.pointer(self._iovecs[i])
+            hdr.msg_iovlen = 1
+            hdr.msg_name = ctypes.addressof(self.addrs[i])
+            hdr.msg_namelen = ctypes.sizeof(_SockAddrLL)
+
+    def recv(self, fd):
+        "Block until at least one frame is available and return how many were read."
+        count = _retry_eintr(_libc.recvmmsg, fd, ctypes.addressof(self.msgs), self.size, MSG_WAITFORONE, None)
+        for i in range(count):
+            # The kernel overwrites namelen with the size it actually used
+            self.msgs[i].msg_hdr.msg_namelen = ctypes.sizeof(_SockAddrLL)
+        return count
+
+    def address(self, i):
+        "Address of the i-th frame buffer, so it can be queued for sending without a copy."
+        return ctypes.addressof(self._views[i])
 
+class TxBatch(object):
+    "Frames queued for one interface and flushed with a single sendmmsg call."
+    def __init__(self, sock, size=BATCH_SIZE):
+        self.sock = sock
+        self.size = size
+        self.count = 0
+        self.msgs = (_MMsgHdr * size)()
+        self._iovecs = (_IoVec * size)()
+        for i in range(size):
+            self.msgs[i].msg_hdr.msg_iov = ctypes.pointer(self._iovecs[i])
+            self.msgs[i].msg_hdr.msg_iovlen = 1
+
+    def push(self, address, length):
+        self._iovecs[self.count].iov_base = address
+        self._iovecs[self.count].iov_len = length
+        self.count += 1
+        if self.count == self.size:
+            self.flush()
+
+    def flush(self):
+        sent = 0
+        while sent < self.count:
+            first = ctypes.addressof(self.msgs) + sent * ctypes.sizeof(_MMsgHdr)
+            sent += _retry_eintr(_libc.sendmmsg, self.sock.fileno(), first, self.count - sent, 0)
+        self.count = 0
+
+local_interfaces = {}     # Interface name -> address as int
+local_ip_set = frozenset()  # Interface addresses as ints
+local_macs = {}
+tx_sockets = {}
+advert_templates = {}
+neighbor_macs = {}
+iface_names = []    # Interface id -> name
+iface_index = {}    # Interface name -> id
+
+# Routing table stored by column, route i is (networks[i], masks[i], ...)
+networks = array('I')
+masks = array('B')
+next_hops = array('I')  # 0 for directly connected networks
+costs = array('I')
+iface_ids = array('B')
+network_index = {}  # Network as int -> route index
+advert_payload = b''  # TRP records of the whole table, rebuilt when it changes
+
+# Forwarding snapshot, ((netmask, {network: (iface id, next hop)}), ...) longest
+# prefix first. Never modified, build_fib() replaces it as a whole.
+fib = ()
+
+def share_routes(cpu=None):
+    "Periodically send the routing table to neighbors, all routes in one frame per interface"
+    if cpu is not None:
+        os.sched_setaffinity(0, {cpu})  # Only affects this thread
+    next_tick = time.monotonic()
+    while True:
+        payload = advert_payload
+        for iface_name, header in advert_templates.items():
+            for start in range(0, len(payload), MAX_ADVERT_PAYLOAD):
+                records = payload[start:start + MAX_ADVERT_PAYLOAD]
+                _set_ip_length(header, _TRP_HEADER.size + len(records))
                 try:
-                    sendp(pkt, iface=iface_name, verbose=0)
+                    tx_sockets[iface_name].sendmsg([header, TRP_HEADER_BYTES, records])
                 except Exception as e:
-                    print("Error sending packet on {}: {}".format(iface_name, e))
+                    logger.error("Error sending packet on %s: %s", iface_name, e)
 
-        time.sleep(2)
+        # Sleep until the next deadline so sending time does not add drift
+        next_tick += SHARE_INTERVAL
+        time.sleep(max(0, next_tick - time.monotonic()))
 
-def handle_route_share(pkt):
-    is_new_entry = True
+def _set_ip_length(header, payload_len):
+    "Update total length and checksum of the IP header of an advertisement frame."
+    struct.pack_into("!H", header, 16, 20 + payload_len)
+    struct.pack_into("!H", header, 24, 0)
+    total = sum(struct.unpack_from("!10H", header, 14))
+    total = (total & 0xFFFF) + (total >> 16)
+    total += total >> 16
+    struct.pack_into("!H", header, 24, ~total & 0xFFFF)
+
+def pack_routes():
+    "Rebuild the advertised TRP records, called by the writer after the table changes."
+    global advert_payload
+    advert_payload = b''.join(_TRP_RECORD.pack(network, mask, min(cost, TRP_MAX_COST))
+                              for network, mask, cost in zip(networks, masks, costs))
+
+def add_route(network, mask, next_hop, cost, iface_id):
+    "Append a route to the table columns."
+    networks.append(network)
+    masks.append(mask)
+    next_hops.append(next_hop)
+    costs.append(cost)
+    iface_ids.append(iface_id)
+    # Keep the first route of a network, as the table was always searched in order
+    network_index.setdefault(network, len(networks) - 1)
+
+def handle_route_share(frame, length, iface_id):
+    "Apply the TRP records of an advertisement frame to the routing table."
+    start = 14 + (frame[14] & 0x0F) * 4
+    # Trust the IP total length over the frame length, which may include padding
+    end = min(length, 14 + struct.unpack_from("!H", frame, 16)[0])
+    if end - start < _TRP_HEADER.size or _TRP_HEADER.unpack_from(frame, start)[0] != TRP_ID:
+        return
+    start += _TRP_HEADER.size
+    end -= (end - start) % _TRP_RECORD.size
+    next_hop = struct.unpack_from("!I", frame, 26)[0]  # Advertising interface
     updated = False
 
-    network = _get_network(pkt[TRP].network, pkt[TRP].mask)
-    for route in routing_table:
-        if route['network'] == network.network_address:
-            is_new_entry = False
-            # Handle update for best route
-            if pkt[TRP].cost + 1 < route['cost']:
-                old_route = route.copy()
-                route['iface'] = pkt.sniffed_on
-                route['next_hop'] = pkt[IP].src
-                route['cost'] = pkt[TRP].cost + 1
-                updated = True
-                show_new_best_route(old_route, route)
-
-    if is_new_entry:
-        routing_table.append({
-            'network': network.network_address,
-            'mask': pkt[TRP].mask,
-            'cost': pkt[TRP].cost + 1,  # Add one to cost for each iteration
-            'next_hop': pkt[IP].src,
-            'iface': pkt.sniffed_on
-        })
-        updated = True
-
-    if updated:
+    for network, mask, cost in _TRP_RECORD.iter_unpack(memoryview(frame)[start:end]):
+        if mask > 32:
+            continue
+        updated |= update_route(network & _NETMASKS[mask], mask, cost + 1, next_hop, iface_id)
+
+    if not updated:
+        return
+    pack_routes()
+    build_fib()
+    # Dumping the whole table on every change is only worth it when debugging
+    if logger.isEnabledFor(logging.DEBUG):
         show_routing_table()
 
+def update_route(network, mask, cost, next_hop, iface_id):
+    "Apply one advertised route, return whether the table changed."
+    i = network_index.get(network)
+    if i is None:
+        add_route(network, mask, next_hop, cost, iface_id)
+        return True
+
+    # Handle update for best route
+    old_cost = costs[i]
+    if cost < old_cost:
+        old_next_hop, old_iface_id = next_hops[i], iface_ids[i]
+        next_hops[i] = next_hop
+        iface_ids[i] = iface_id
+        costs[i] = cost
+        show_new_best_route(i, old_next_hop, old_iface_id, old_cost)
+        return True
+    return False
+
 def show_interfaces():
-    print('\n[Interfaces] Entries: {}\n-------------------------'.format(len(local_interfaces)))
-    print("{:<12} {:<12}".format('Name', 'IP'))
+    lines = ['\n[Interfaces] Entries: {}\n-------------------------'.format(len(local_interfaces)),
+             "{:<12} {:<12}".format('Name', 'IP')]
     for iface_name, iface_ip in local_interfaces.items():
-        print("{:<12} {:<12}".format(iface_name, iface_ip))
-    print('-------------------------\n')
+        lines.append("{:<12} {:<12}".format(iface_name, _ip_str(iface_ip)))
+    lines.append('-------------------------\n\n')
+    sys.stdout.write('\n'.join(lines))
 
 def show_routing_table():
-    print('\n[Routing Table] Entries: {}\n-------------------------'.format(len(routing_table)))
-    print("{:<12} {:<12} {:<10} {:<5}".format('Network', 'Next hop', 'Interface', 'Cost'))
-    for route in routing_table:
-        print("{:<12} {:<12} {:<10} {:<5}".format(
-            '{}/{}'.format(route['network'], route['mask']),
-            str(route['next_hop']), route['iface'], route['cost']))
-    print('-------------------------\n')
-
-def show_new_best_route(old_route, new_route):
-    print('\n[New route] {}/{}\n-------------------------'.format(old_route['network'], old_route['mask']))
-    print("      {:<12} {:<10} {:<5}".format('Next hop', 'Interface', 'Cost'))
-    print("[OLD] {:<12} {:<10} {:<5}".format(str(old_route['next_hop']), old_route['iface'], old_route['cost']))
-    print("[NEW] {:<12} {:<10} {:<5}".format(str(new_route['next_hop']), new_route['iface'], new_route['cost']))
-    print('-------------------------\n')
-
-def _get_network(ip, mask):
-    return ipaddress.ip_network("{}/{}".format(ip, mask), False)
+    lines = ['\n[Routing Table] Entries: {}\n-------------------------'.format(len(networks)),
+             "{:<12} {:<12} {:<10} {:<5}".format('Network', 'Next hop', 'Interface', 'Cost')]
+    for i in range(len(networks)):
+        lines.append("{:<12} {:<12} {:<10} {:<5}".format(
+            _prefix_str(networks[i], masks[i]),
+            _ip_str(next_hops[i]), iface_names[iface_ids[i]], costs[i]))
+    lines.append('-------------------------\n\n')
+    sys.stdout.write('\n'.join(lines))
+
+def show_new_best_route(i, old_next_hop, old_iface_id, old_cost):
+    sys.stdout.write('\n'.join((
+        '\n[New route] {}\n-------------------------'.format(_prefix_str(networks[i], masks[i])),
+        "      {:<12} {:<10} {:<5}".format('Next hop', 'Interface', 'Cost'),
+        "[OLD] {:<12} {:<10} {:<5}".format(_ip_str(old_next_hop), iface_names[old_iface_id], old_cost),
+        "[NEW] {:<12} {:<10} {:<5}".format(_ip_str(next_hops[i]), iface_names[iface_ids[i]], costs[i]),
+        '-------------------------\n\n')))
+
+def build_fib():
+    "Publish a new forwarding snapshot, called by the writer after the table changes."
+    global fib
+    by_mask = {}
+    for network, mask, next_hop, iface_id in zip(networks, masks, next_hops, iface_ids):
+        # Keep the first route of a network, as the table was always searched in order
+        by_mask.setdefault(mask, {}).setdefault(network, (iface_id, next_hop))
+    fib = tuple((_NETMASKS[mask], by_mask[mask]) for mask in sorted(by_mask, reverse=True))
+
+def fib_lookup(dst):
+    "Longest prefix match for an IPv4 address given as int, returns (iface id, next hop)."
+    for netmask, routes in fib:  # fib is read once, lookups never see a half update
+        route = routes.get(dst & netmask)
+        if route is not None:
+            return route
+    return None
+
+def _ip_int(ip):
+    "Dotted IPv4 address to int, the form used everywhere past init()."
+    return struct.unpack("!I", socket.inet_aton(ip))[0]
+
+@lru_cache(maxsize=None)
+def _ip_str(ip):
+    return socket.inet_ntoa(struct.pack("!I", ip))
+
+@lru_cache(maxsize=None)
+def _prefix_str(network, mask):
+    return '{}/{}'.format(_ip_str(network), mask)
 
 def init(node):
-    global routing_table, local_interfaces
     "Load configuration from the node config file."
+    global local_ip_set
     try:
-        with open('tmp/{}.json'.format(node), 'r') as f:
-            routing_table = json.load(f)
+        with open('tmp/{}.json'.format(node), 'rb') as f:
+            config = json_loads(f.read())
 
-        for route in routing_table:
+        for route in config:
+            if route['iface'] not in iface_index:
+                iface_index[route['iface']] = len(iface_names)
+                iface_names.append(route['iface'])
             # Make sure that the network IP is being used
-            network = _get_network(route['network'], route['mask'])
-            route['network'] = network.network_address
+            mask = int(route['mask'])
+            add_route(_ip_int(route['network']) & _NETMASKS[mask], mask,
+                      _ip_int(route['next_hop']), route['cost'],
+                      iface_index[route['iface']])
+        pack_routes()
+        build_fib()
 
-        ifaces = [route['iface'] for route in routing_table]
         for iface_name, iface in conf.ifaces.items():
-            if iface_name in ifaces:
-                local_interfaces[iface_name] = iface.ip
+            if iface_name in iface_index:
+                local_interfaces[iface_name] = _ip_int(iface.ip)
+                local_macs[iface_name] = mac2str(iface.mac)
+                # Long-lived TX socket, protocol 0 so it never receives
+                tx_sockets[iface_name] = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
+                tx_sockets[iface_name].bind((iface_name, 0))
+                # Advertisement headers built once, only the IP length changes
+                advert_templates[iface_name] = bytearray(bytes(
+                    Ether(dst="ff:ff:ff:ff:ff:ff", src=iface.mac) /
+                    IP(src=iface.ip, dst="255.255.255.255", proto=TRP_PROTO)))
+        local_ip_set = frozenset(local_interfaces.values())
 
-        return routing_table
+        return networks
     except FileNotFoundError:
-        print("ERROR: Configuration file for host {} not found in tmp/.".format(node))
+        logger.error("ERROR: Configuration file for host %s not found in tmp/.", node)
         return None
 
-def forward_packet(pkt):
+def _lookup_mac(ip):
+    "Ask for the MAC of a neighbor and replace its broadcast placeholder once it answers."
+    resolved = getmacbyip(_ip_str(ip))
+    if resolved is not None:
+        neighbor_macs[ip] = mac2str(resolved)
+
+def _resolve_mac(ip):
+    "Cached MAC address of a neighbor given as int, broadcast until it is known."
+    mac = neighbor_macs.get(ip)
+    if mac is None:
+        # Never block the receiver on ARP, routers on OVS ports may never answer
+        mac = neighbor_macs[ip] = BROADCAST_MAC
+        threading.Thread(target=_lookup_mac, args=(ip,), daemon=True).start()
+    return mac
+
+def forward_packet(rx, i, dst, recv_iface_id, tx_batches):
     "Forward packets based on forwarding table using vector-distance algorithm."
-    if IP in pkt and TRP not in pkt:  # Ensure the packet is an IP packet and not a routing packet
-        dst = ipaddress.ip_address(pkt[IP].dst)
-        for route in routing_table:
-            route_network = _get_network(route['network'], route['mask'])
-            if dst in route_network and route['iface'] != pkt.sniffed_on:
-                # Modify MAC address instead of setting to None
-                pkt[Ether].dst = None
-                sendp(pkt, iface=route['iface'], verbose=0)
-                break  # Stop after first match to prevent multiple forwarding
-    else:
-        print("Non-IP packet or routing packet received, ignoring.")
+    if dst in local_ip_set:  # Addressed to the router itself
+        return
+    route = fib_lookup(dst)
+    if route is None:
+        return
+    iface_id, next_hop = route
+    # Never send a packet back through the interface it came from
+    if iface_id == recv_iface_id:
+        return
+
+    dst_mac = _resolve_mac(next_hop or dst)
+    # Rewrite the Ethernet header in place and send the same buffer
+    out_iface = iface_names[iface_id]
+    rx.frames[i][0:12] = dst_mac + local_macs[out_iface]
+    tx_batches[out_iface].push(rx.address(i), rx.msgs[i].msg_len)
+
+def _bpf_filter(ifindexes):
+    "Classic BPF program accepting IPv4 frames received (not sent) on the given interfaces."
+    count = len(ifindexes)
+    program = [(0x28, 0, 0, 12),                                 # ldh [12], the ethertype
+               (0x15, 0, count + 3, ETH_P_IP),                   # jne IPv4 -> drop
+               (0x20, 0, 0, SKF_AD_PKTTYPE),                     # ld pkttype
+               (0x15, count + 1, 0, socket.PACKET_OUTGOING),     # jeq outgoing -> drop
+               (0x20, 0, 0, SKF_AD_IFINDEX)]                     # ld ifindex
+    for n, ifindex in enumerate(ifindexes):
+        program.append((0x15, count - n, 0, ifindex))            # jeq ifindex -> accept
+    program.append((0x06, 0, 0, 0))                              # drop: ret #0
+    program.append((0x06, 0, 0, 0xFFFFFFFF))                     # accept: ret whole frame
+    return b''.join(struct.pack("HBBI", *insn) for insn in program)
+
+def receive_loop():
+    "Receive IP frames of every routing interface on one socket, in batches, and dispatch them."
+    ifindexes = {socket.if_nametoindex(name): iface_index[name] for name in local_interfaces}
+    # ETH_P_ALL, as the OVS bridge of a switch port takes the frame before ETH_P_IP sockets see it
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+    code = _bpf_filter(list(ifindexes))
+    program = ctypes.create_string_buffer(code, len(code))
+    # struct sock_fprog: instruction count and a pointer to the instructions
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER,
+                    struct.pack("HP", len(code) // 8, ctypes.addressof(program)))
+
+    # Frames queued before the filter was attached did not go through it
+    sock.setblocking(False)
+    try:
+        while True:
+            sock.recv(FRAME_SIZE)
+    except BlockingIOError:
+        pass
+    sock.setblocking(True)
+
+    rx = RxBatch()
+    tx_batches = {name: TxBatch(tx_sock) for name, tx_sock in tx_sockets.items()}
+
+    while True:
+        count = rx.recv(sock.fileno())
+        for i in range(count):
+            # Skip frames that did not fit the buffer
+            if rx.msgs[i].msg_hdr.msg_flags & socket.MSG_TRUNC:
+                continue
+            iface_id = ifindexes[rx.addrs[i].sll_ifindex]
+            frame = rx.frames[i]
+            proto, dst = _IP_DISPATCH.unpack_from(frame)
+            if proto == TRP_PROTO and dst == BROADCAST_IP:
+                handle_route_share(frame, rx.msgs[i].msg_len, iface_id)
+            else:
+                forward_packet(rx, i, dst, iface_id, tx_batches)
+
+        # Frames point into the RX buffers, so flush before the next recvmmsg
+        for batch in tx_batches.values():
+            if batch.count:
+                batch.flush()
+
+def _cpu_pair(value):
+    "argparse type for --cpus: two CPU numbers given as RX,TX."
+    try:
+        rx_cpu, tx_cpu = (int(cpu) for cpu in value.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected two CPU numbers as RX,TX, got '{}'".format(value))
+    return rx_cpu, tx_cpu
 
 def main():
     parser = argparse.ArgumentParser(description="Router Configuration")
     parser.add_argument("--node", type=str, required=True, help="Name of the node to be used as router. e.g: r1")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print the whole routing table on every update")
+    parser.add_argument("--cpus", type=_cpu_pair, help="Pin receiving and sending to two CPUs, given as RX,TX. e.g: 2,3")
     args = parser.parse_args()
 
+    rx_cpu = tx_cpu = None
+    if args.cpus:
+        rx_cpu, tx_cpu = args.cpus
+        allowed = os.sched_getaffinity(0)
+        for cpu in args.cpus:
+            if cpu not in allowed:
+                parser.error("argument --cpus: CPU {} is not available, allowed: {}".format(
+                    cpu, ','.join(str(c) for c in sorted(allowed))))
+        # Set before starting any thread, so the receiver inherits it
+        try:
+            os.sched_setaffinity(0, {rx_cpu})
+        except OSError as e:
+            parser.error("argument --cpus: could not pin to CPU {}: {}".format(rx_cpu, e.strerror))
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format='%(message)s')
+
     if not init(args.node):
         return
 
@@ -152,12 +471,20 @@ def main():
     show_routing_table()
 
     # Start the routing share thread
-    threading.Thread(target=share_routes, daemon=True).start()
+    threading.Thread(target=share_routes, args=(tx_cpu,), daemon=True).start()
 
-    # Sniff for routing share and data packets
-    sniff(iface=list(local_interfaces.keys()), filter="ip", prn=lambda pkt: handle_route_share(pkt) if TRP in pkt else forward_packet(pkt))
+    # A single receiving thread for routing share and data packets of all interfaces
+    receiver = threading.Thread(target=receive_loop, daemon=True)
+    receiver.start()
+
+    # TX sockets live as long as the router, release them on SIGTERM too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        receiver.join()
+    finally:
+        for tx_sock in tx_sockets.values():
+            tx_sock.close()
 
 
 if __name__ == '__main__':
     main()
-
@@ -1,11 +1,33 @@
-import argparse
+from concurrent.futures import ThreadPoolExecutor
+import ctypes
+import fcntl
+from itertools import chain, combinations
 import json
 import os
+import signal
+import socket
+import struct
+import sys
 from mininet.topo import Topo
 from mininet.net import Link, Mininet
 from mininet.node import Node
-from mininet.log import setLogLevel, info
-from mininet.cli import CLI
+from mininet.log import setLogLevel, info, warn
+
+# ethtool ioctl, what 'ethtool -K <iface> tx off rx off' ends up doing
+SIOCETHTOOL = 0x8946
+ETHTOOL_GRXCSUM = 0x14
+ETHTOOL_SRXCSUM = 0x15
+ETHTOOL_GTXCSUM = 0x16
+ETHTOOL_STXCSUM = 0x17
+CLONE_NEWNET = 0x40000000
+
+_libc = ctypes.CDLL(None, use_errno=True)
+
+# MeshTopo addresses, indexed by host number (1..MESH_SIZE)
+MESH_SIZE = 4
+HOST_IPS = tuple('10.{}.{}.1/24'.format(i, i) for i in range(MESH_SIZE + 1))
+HOST_GWS = tuple('via 10.{}.{}.254'.format(i, i) for i in range(MESH_SIZE + 1))
+ROUTER_IPS = tuple('10.{}.{}.254/24'.format(i, i) for i in range(MESH_SIZE + 1))
 
 class BasicTopo(Topo):
     "A router connecting two hosts"
@@ -31,8 +53,8 @@ class ThreeRoutersTopo(Topo):
         r3 = self.addSwitch('s3')
 
         # Add hosts
-        host1 = self.addHost('h1', ip='10.1.1.1/24', defaultRoute='via 10.1.1.254')
-        host2 = self.addHost('h2', ip='10.2.2.1/24', defaultRoute='via 10.2.2.254')
+        host1 = self.addHost('h1', ip=None, defaultRoute='via 10.1.1.254')
+        host2 = self.addHost('h2', ip=None, defaultRoute='via 10.2.2.254')
 
         # Link r1 and r2 on a unique subnet
         self.addLink(r1, r2, 
@@ -72,8 +94,8 @@ class TwoPathsTopo(Topo):
         s4 = self.addSwitch('s4')
 
         # Add hosts
-        host1 = self.addHost('h1', ip='10.1.1.1/24', defaultRoute='via 10.1.1.254')
-        host2 = self.addHost('h2', ip='10.2.2.1/24', defaultRoute='via 10.2.2.254')
+        host1 = self.addHost('h1', ip=None, defaultRoute='via 10.1.1.254')
+        host2 = self.addHost('h2', ip=None, defaultRoute='via 10.2.2.254')
 
         # Links to r0
         self.addLink(host1, s0, 
@@ -119,25 +141,22 @@ class MeshTopo(Topo):
     def build(self, **_opts):
         # Create switches for each host
         switches = []
-        for i in range(1, 5):
+        for i in range(1, MESH_SIZE + 1):
             switch = self.addSwitch('s{}'.format(i))
             switches.append(switch)
 
             # Create hosts and link each to its switch
-            host = self.addHost('h{}'.format(i), ip='10.{}.{}.1/24'.format(i, i), defaultRoute='via 10.{}.{}.254'.format(i, i))
+            host = self.addHost('h{}'.format(i), ip=None, defaultRoute=HOST_GWS[i])
             self.addLink(host, switch,
-                         intfName1='h{}-eth0'.format(i), params1={'ip': '10.{}.{}.1/24'.format(i, i)},
-                         intfName2='s{}-eth0'.format(i), params2={'ip': '10.{}.{}.254/24'.format(i, i)})
-
-        # Fully connect switches
-        subnet_counter = 1
-        for i, sw1 in enumerate(switches):
-            for j, sw2 in enumerate(switches):
-                if j > i:  # Avoid duplicate connections
-                    self.addLink(sw1, sw2,
-                                 intfName1='s{}-eth{}'.format(i+1, subnet_counter), params1={'ip': '10.5.{}.{}/24'.format(subnet_counter, i)},
-                                 intfName2='s{}-eth{}'.format(j+1, subnet_counter), params2={'ip': '10.5.{}.{}/24'.format(subnet_counter, j)})
-                    subnet_counter += 1
+                         intfName1='h{}-eth0'.format(i), params1={'ip': HOST_IPS[i]},
+                         intfName2='s{}-eth0'.format(i), params2={'ip': ROUTER_IPS[i]})
+
+        # Fully connect switches, each pair once with its own subnet
+        links = list(enumerate(combinations(enumerate(switches, start=1), 2), start=1))
+        for subnet_counter, ((i, sw1), (j, sw2)) in links:
+            self.addLink(sw1, sw2,
+                         intfName1='s{}-eth{}'.format(i, subnet_counter), params1={'ip': '10.5.{}.{}/24'.format(subnet_counter, i)},
+                         intfName2='s{}-eth{}'.format(j, subnet_counter), params2={'ip': '10.5.{}.{}/24'.format(subnet_counter, j)})
 
     def __str__(self):
         return """
@@ -151,77 +170,128 @@ class MeshTopo(Topo):
                            x
         """
 
-def _get_info(nodes, net):
+def _link_peers(net):
+    "Map every linked interface name to the address and prefix length of the other end."
+    peers = {}
+    for link in net.links:
+        # setIP() caches the address on the interface, no need to go through IP()
+        end1 = (link.intf1.ip, link.intf1.prefixLen)
+        end2 = (link.intf2.ip, link.intf2.prefixLen)
+        peers[link.intf1.name] = end2
+        peers[link.intf2.name] = end1
+    return peers
+
+def _get_info(node, peers):
     "Helper function to gather interface and neighbor information."
-    route_info = {}
-    for node in nodes:
-        interfaces = node.intfList()
-        neighbors = []
-        for intf in interfaces:
-            # Find the link connected to this interface
-            for link in net.links:
-                # Check if the link has one of the node interfaces
-                if intf.name == link.intf2.name or intf.name == link.intf1.name:
-                    neighbor = link.intf1 if link.intf2 == intf.name else link.intf1
-                    # Identify the neighbor based on the other interface in the link
-                    neighbors.append({
-                        'network': neighbor.IP(),
-                        'mask': neighbor.prefixLen,
-                        'next_hop': '0.0.0.0',
-                        'iface': intf.name,
-                        'cost': 0
-                    })
-
-        route_info[node.name] = neighbors
-
-    return route_info
+    neighbors = []
+    for intf in node.intfList():
+        # Find the other end of the link connected to this interface
+        peer = peers.get(intf.name)
+        if peer is None:
+            continue
+        neighbors.append({
+            'network': peer[0],
+            'mask': peer[1],
+            'next_hop': '0.0.0.0',
+            'iface': intf.name,
+            'cost': 0
+        })
+    return neighbors
 
 def configure_initial_table(net):
-    # Combine host and switch info
-    hosts_info = _get_info(net.hosts, net)
-    switches_info = _get_info(net.switches, net)
-    route_info = {**hosts_info, **switches_info}  # Use dictionary unpacking alternative
-
     "Outputs routing configurations for each host and writes to a file."
-    for host_name, config in route_info.items():
-        if not os.path.exists('./tmp'):
-            os.makedirs('./tmp')
+    peers = _link_peers(net)
+    route_info = {node.name: _get_info(node, peers) for node in chain(net.hosts, net.switches)}
 
+    os.makedirs('./tmp', exist_ok=True)
+    for host_name, config in route_info.items():
         config_file = "./tmp/{}.json".format(host_name)
         with open(config_file, 'w') as f:
             json.dump(config, f)
 
-def run(topo):
+def _setns(ns_file):
+    if _libc.setns(ns_file.fileno(), CLONE_NEWNET) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+def _netns_socket(node):
+    "Open a socket inside the network namespace of a node."
+    with open('/proc/thread-self/ns/net') as own_ns, open('/proc/{}/ns/net'.format(node.pid)) as node_ns:
+        _setns(node_ns)
+        try:
+            return socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        finally:
+            _setns(own_ns)
+
+def _ethtool(sock, ifname, cmd, data=0):
+    "Issue an ethtool_value ioctl on an interface and return the resulting data field."
+    value = ctypes.create_string_buffer(struct.pack('II', cmd, data), 8)  # struct ethtool_value
+    ifreq = struct.pack('16sP16x', ifname.encode(), ctypes.addressof(value))
+    fcntl.ioctl(sock, SIOCETHTOOL, ifreq)
+    return struct.unpack('II', value.raw)[1]
+
+def disable_offloads(node):
+    "Turn off TX/RX checksum offload of every node interface, without running ethtool."
+    # ioctls act on the namespace the socket was created in
+    with _netns_socket(node) as sock:
+        for itf in node.intfList():
+            if itf.name == 'lo':
+                continue
+            for get_cmd, set_cmd in ((ETHTOOL_GTXCSUM, ETHTOOL_STXCSUM), (ETHTOOL_GRXCSUM, ETHTOOL_SRXCSUM)):
+                try:
+                    # Setting a feature makes the kernel recompute every feature, skip it when already off
+                    if _ethtool(sock, itf.name, get_cmd):
+                        _ethtool(sock, itf.name, set_cmd)
+                except OSError as e:
+                    warn("*** Could not disable offload on {}: {}\n".format(itf.name, e))
+
+def run(topo, cli=True):
     "Run Mininet with the chosen topology"
-    net = Mininet(topo=topo, controller=None)
-    for _, v in net.nameToNode.items():
-        for itf in v.intfList():
-            v.cmd('ethtool -K '+itf.name+' tx off rx off')
+    # No controller to wait for, the routers are driven by routing.py
+    net = Mininet(topo=topo, controller=None, waitConnected=False)
+    nodes = net.hosts + net.switches
+    # Nodes are independent, and setns() only moves the calling thread
+    with ThreadPoolExecutor(max_workers=max(1, min(32, len(nodes)))) as executor:
+        list(executor.map(disable_offloads, nodes))
     net.start()
 
-    configure_initial_table(net)
-    
-    CLI(net)
-    net.stop()
+    try:
+        configure_initial_table(net)
+
+        if cli:
+            from mininet.cli import CLI  # only interactive runs pay for cmd/readline
+            CLI(net)
+        else:
+            info("*** Running without CLI, stop with Ctrl+C or SIGTERM\n")
+            signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+            try:
+                signal.pause()
+            except KeyboardInterrupt:
+                pass
+    finally:
+        net.stop()
+
+topo_classes = {
+    'Basic': BasicTopo,
+    'TwoPaths': TwoPathsTopo,
+    'ThreeRouters': ThreeRoutersTopo,
+    'Mesh': MeshTopo
+}
 
 def main():
+    import argparse  # only needed when run as a script, not when imported for the Topo classes
     parser = argparse.ArgumentParser(description="Run a Mininet topology")
-    parser.add_argument("--topo", type=str, choices=['Basic', 'Mesh', 'ThreeRouters', "TwoPaths"], default='Basic',
-                        help="Choose the topology to run (default: Basic). Options: Basic, Mesh, ThreeRouters, TwoPaths.")
+    parser.add_argument("--topo", type=str, choices=sorted(topo_classes), default='Basic',
+                        help="Choose the topology to run (default: Basic). Options: {}.".format(', '.join(sorted(topo_classes))))
+    parser.add_argument("--no-cli", action='store_true',
+                        help="Do not open the Mininet CLI, keep the network up until interrupted.")
     args = parser.parse_args()
 
-    topo_classes = {
-        'Basic': BasicTopo,
-        'TwoPaths': TwoPathsTopo,
-        'ThreeRouters': ThreeRoutersTopo,
-        'Mesh': MeshTopo
-    }
-
-    topo_class = topo_classes.get(args.topo)
+    topo_class = topo_classes[args.topo]
     topo = topo_class()
     info("*** Starting topology: {}\n".format(args.topo))
     info(str(topo))
-    run(topo)
+    run(topo, cli=not args.no_cli)
 
 if __name__ == '__main__':
     setLogLevel('info')